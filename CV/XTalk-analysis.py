@@ -1,18 +1,29 @@
+import math
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
+from numba import njit, prange
+
+# sRGB -> linear RGB lookup table for every possible uint8 value
+_SRGB_LUT = np.empty(256, np.float32)
+_x = np.arange(256) / 255.0
+_mask = _x <= 0.04045
+_SRGB_LUT[_mask] = _x[_mask] / 12.92
+_SRGB_LUT[~_mask] = ((_x[~_mask] + 0.055) / 1.055) ** 2.4
+
+# Kept as float32 so the crosstalk ratio is not promoted to float64
+_EPS = np.float32(1e-6)
 
 def order_points(pts):
     """Order points as: top-left, top-right, bottom-right, bottom-left"""
-    rect = np.zeros((4, 2), dtype="float32")
-    s = pts.sum(axis=1)
-    rect[0] = pts[np.argmin(s)]  # top-left
-    rect[2] = pts[np.argmax(s)]  # bottom-right
-
-    diff = np.diff(pts, axis=1)
-    rect[1] = pts[np.argmin(diff)]  # top-right
-    rect[3] = pts[np.argmax(diff)]  # bottom-left
-    return rect
+    s = pts[:, 0] + pts[:, 1]
+    d = pts[:, 0] - pts[:, 1]
+    return np.array([
+        pts[np.argmin(s)],  # top-left
+        pts[np.argmax(d)],  # top-right
+        pts[np.argmax(s)],  # bottom-right
+        pts[np.argmin(d)]   # bottom-left
+    ], dtype=np.float32)
 
 def four_point_transform(image, pts):
     """Perform a perspective transform to rectify the image based on the four corners."""
@@ -20,12 +31,12 @@ def four_point_transform(image, pts):
     (tl, tr, br, bl) = rect
 
     # Compute the width and height of the new image
-    widthA = np.linalg.norm(br - bl)
-    widthB = np.linalg.norm(tr - tl)
+    widthA = math.hypot(br[0] - bl[0], br[1] - bl[1])
+    widthB = math.hypot(tr[0] - tl[0], tr[1] - tl[1])
     maxWidth = max(int(widthA), int(widthB))
 
-    heightA = np.linalg.norm(tr - br)
-    heightB = np.linalg.norm(tl - bl)
+    heightA = math.hypot(tr[0] - br[0], tr[1] - br[1])
+    heightB = math.hypot(tl[0] - bl[0], tl[1] - bl[1])
     maxHeight = max(int(heightA), int(heightB))
 
     # Destination points for the transform
@@ -42,20 +53,35 @@ def four_point_transform(image, pts):
     return warped
 
 def sRGB_to_linearRGB(image):
-    """Convert sRGB image to linear RGB."""
-    image = image / 255.0
-    mask = image <= 0.04045
-    image[mask] = image[mask] / 12.92
-    image[~mask] = ((image[~mask] + 0.055) / 1.055) ** 2.4
-    return image
+    """Convert a uint8 sRGB image to float32 linear RGB."""
+    return _SRGB_LUT[image]
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _xtalk(img, num_ch, den_ch, out):
+    """Write the ratio img[..., num_ch] / img[..., den_ch], clipped to 1, into out."""
+    H, W, _ = img.shape
+    for y in prange(H):
+        for x in range(W):
+            v = img[y, x, num_ch] / (img[y, x, den_ch] + _EPS)
+            out[y, x] = v if v < 1.0 else 1.0
+
+def find_screen_corners(contour):
+    """Approximate a contour by its four corners, falling back to its minimum-area rectangle."""
+    peri = cv2.arcLength(contour, True)
+    approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
+    if len(approx) == 4:
+        return approx.reshape(4, 2).astype(np.float32)
+    return cv2.boxPoints(cv2.minAreaRect(contour)).astype(np.float32)
 
 def compute_crosstalk(image_left, image_right):
     """Compute the cross-talk for the left and right eye using linear RGB."""
     # For left eye: Cross-talk is the ratio of blue to red (blue/red).
-    left_crosstalk = image_left[:, :, 0] / (image_left[:, :, 2] + 1e-6)  # Blue/Red ratio
+    left_crosstalk = np.empty(image_left.shape[:2], dtype=np.float32)
+    _xtalk(image_left, 0, 2, left_crosstalk)  # Blue/Red ratio
     
     # For right eye: Cross-talk is the ratio of red to blue (red/blue).
-    right_crosstalk = image_right[:, :, 2] / (image_right[:, :, 0] + 1e-6)  # Red/Blue ratio
+    right_crosstalk = np.empty(image_right.shape[:2], dtype=np.float32)
+    _xtalk(image_right, 2, 0, right_crosstalk)  # Red/Blue ratio
     
     return left_crosstalk, right_crosstalk
 
@@ -100,11 +126,7 @@ def main(left_image_path, right_image_path, red_range, blue_range, screen_resolu
     
     # Select the largest contour for left image and approximate it to a polygon
     c_left = max(contours_left, key=cv2.contourArea)
-    peri_left = cv2.arcLength(c_left, True)
-    approx_left = cv2.approxPolyDP(c_left, 0.02 * peri_left, True)
-    if len(approx_left) != 4:
-        print("Could not detect four corners for left image.")
-        return
+    approx_left = find_screen_corners(c_left)
     
     # Process right image (blue region detection)
     hsv_right = cv2.cvtColor(right_image, cv2.COLOR_BGR2HSV)
@@ -116,15 +138,11 @@ def main(left_image_path, right_image_path, red_range, blue_range, screen_resolu
     
     # Select the largest contour for right image and approximate it to a polygon
     c_right = max(contours_right, key=cv2.contourArea)
-    peri_right = cv2.arcLength(c_right, True)
-    approx_right = cv2.approxPolyDP(c_right, 0.02 * peri_right, True)
-    if len(approx_right) != 4:
-        print("Could not detect four corners for right image.")
-        return
+    approx_right = find_screen_corners(c_right)
     
     # Rectify both images using the four point transform
-    warped_left = four_point_transform(left_image_linear, approx_left.reshape(4, 2))
-    warped_right = four_point_transform(right_image_linear, approx_right.reshape(4, 2))
+    warped_left = four_point_transform(left_image_linear, approx_left)
+    warped_right = four_point_transform(right_image_linear, approx_right)
     
     # Compute cross-talk maps for both eyes
     left_crosstalk, right_crosstalk = compute_crosstalk(warped_left, warped_right)
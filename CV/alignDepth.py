@@ -4,100 +4,163 @@
 # This notebook demonstrates how to align and blend an outpainted depth map with the original depth map to ensure continuity and smooth transitions. The process involves global brightness/contrast adjustment, translation correction, and bilateral filtering.
 
 # %% 
-from PIL import Image
+import os
 import numpy as np
 import cv2
+try:
+    import cv2.ximgproc as xip  # opencv-contrib only
+except ImportError:
+    xip = None
 import matplotlib.pyplot as plt
+from numba import njit, prange
+
+# Intermediate plots are only drawn when CV_SHOW=1, so batch/headless runs skip matplotlib entirely
+DEBUG_PLOT = os.environ.get("CV_SHOW", "0") == "1"
 
 # %% [markdown]
 # ## Load Images
-# Load the original and outpainted depth maps using the `PIL` library and convert them to grayscale.
+# Load the original and outpainted depth maps directly as grayscale numpy arrays with OpenCV.
 
 # %%
 original_depth_map_path = "/mnt/data/lady_disparity.png"
 outpainted_depth_map_path = "/mnt/data/lady_outpainted_0-20_disparity.png"
-
-original_depth_map = Image.open(original_depth_map_path).convert("L")
-outpainted_depth_map = Image.open(outpainted_depth_map_path).convert("L")
-
-# %% [markdown]
-# ## Convert Images to Numpy Arrays
-# Convert the loaded images into numpy arrays for processing.
-
-# %%
-original_depth_map_np = np.array(original_depth_map)
-outpainted_depth_map_np = np.array(outpainted_depth_map)
-
-# Display the original and outpainted depth maps
-plt.figure(figsize=(12, 6))
-plt.subplot(1, 2, 1)
-plt.title("Original Depth Map")
-plt.imshow(original_depth_map_np, cmap="gray")
-plt.subplot(1, 2, 2)
-plt.title("Outpainted Depth Map")
-plt.imshow(outpainted_depth_map_np, cmap="gray")
-plt.show()
+outpainted_rgb_path = "/mnt/data/lady_outpainted_0-20.png"  # RGB guide for edge-aware filtering
+
+original_depth_map_np = cv2.imread(original_depth_map_path, cv2.IMREAD_GRAYSCALE)
+outpainted_depth_map_np = cv2.imread(outpainted_depth_map_path, cv2.IMREAD_GRAYSCALE)
+
+if DEBUG_PLOT:
+    # Display the original and outpainted depth maps
+    plt.figure(figsize=(12, 6))
+    plt.subplot(1, 2, 1)
+    plt.title("Original Depth Map")
+    plt.imshow(original_depth_map_np, cmap="gray")
+    plt.subplot(1, 2, 2)
+    plt.title("Outpainted Depth Map")
+    plt.imshow(outpainted_depth_map_np, cmap="gray")
+    plt.show()
 
 # %% [markdown]
 # ## Step 1: Global Brightness/Contrast Adjustment
 # Adjust the brightness and contrast of the outpainted depth map using histogram matching to better match the original depth map.
 
 # %%
-original_hist, bins = np.histogram(original_depth_map_np.flatten(), 256, [0,256])
-cdf_original = original_hist.cumsum()
-cdf_original_normalized = cdf_original * float(original_hist.max()) / cdf_original.max()
-
-outpainted_hist, bins = np.histogram(outpainted_depth_map_np.flatten(), 256, [0,256])
-cdf_outpainted = outpainted_hist.cumsum()
-cdf_outpainted_normalized = cdf_outpainted * float(outpainted_hist.max()) / cdf_outpainted.max()
-
-cdf_m = np.ma.masked_equal(cdf_outpainted, 0)
-cdf_m = (cdf_m - cdf_m.min()) * 255 / (cdf_m.max() - cdf_m.min())
-cdf = np.ma.filled(cdf_m, 0).astype('uint8')
-
-outpainted_depth_map_matched = cdf[outpainted_depth_map_np]
-
-# Display the brightness/contrast adjusted outpainted depth map
-plt.figure(figsize=(6, 6))
-plt.title("Outpainted Depth Map after Brightness/Contrast Adjustment")
-plt.imshow(outpainted_depth_map_matched, cmap="gray")
-plt.show()
+# Normalized CDFs of both depth maps
+src_cdf = np.cumsum(np.bincount(outpainted_depth_map_np.ravel(), minlength=256)).astype(np.float64)
+src_cdf /= src_cdf[-1]
+ref_cdf = np.cumsum(np.bincount(original_depth_map_np.ravel(), minlength=256)).astype(np.float64)
+ref_cdf /= ref_cdf[-1]
+
+# Map each outpainted level to the original level with the same CDF value
+lut = np.interp(src_cdf, ref_cdf, np.arange(256)).astype(np.uint8)
+outpainted_depth_map_matched = lut[outpainted_depth_map_np]
+
+if DEBUG_PLOT:
+    # Display the brightness/contrast adjusted outpainted depth map
+    plt.figure(figsize=(6, 6))
+    plt.title("Outpainted Depth Map after Brightness/Contrast Adjustment")
+    plt.imshow(outpainted_depth_map_matched, cmap="gray")
+    plt.show()
 
 # %% [markdown]
 # ## Step 2: Translation Adjustment
-# Correct any minor misalignment between the original and outpainted depth maps using template matching.
+# Correct any minor misalignment between the original and outpainted depth maps using FFT-based phase correlation.
 
 # %%
-res = cv2.matchTemplate(outpainted_depth_map_matched, original_depth_map_np, cv2.TM_CCOEFF_NORMED)
-_, _, _, max_loc = cv2.minMaxLoc(res)
-
-# Determine translation offsets
-top_left = max_loc
 height_original, width_original = original_depth_map_np.shape
 height_outpainted, width_outpainted = outpainted_depth_map_matched.shape
 
+# Pad the original depth map, centered, to the outpainted size so both maps can be phase-correlated
+center_y = (height_outpainted - height_original) // 2
+center_x = (width_outpainted - width_original) // 2
+padded_original_depth_map = np.zeros_like(outpainted_depth_map_matched, dtype=np.float32)
+padded_original_depth_map[center_y:center_y+height_original, center_x:center_x+width_original] = original_depth_map_np
+
+(dx, dy), _ = cv2.phaseCorrelate(padded_original_depth_map, outpainted_depth_map_matched.astype(np.float32))
+
+# Determine translation offsets, keeping the original map inside the canvas
+top_left = (
+    int(np.clip(center_x + round(dx), 0, width_outpainted - width_original)),
+    int(np.clip(center_y + round(dy), 0, height_outpainted - height_original)),
+)
+
 # Create a blank canvas for the translated depth map
 translated_outpainted_depth_map = np.zeros_like(outpainted_depth_map_matched)
 translated_outpainted_depth_map[top_left[1]:top_left[1]+height_original, top_left[0]:top_left[0]+width_original] = original_depth_map_np
 
-# Display the translated outpainted depth map
-plt.figure(figsize=(6, 6))
-plt.title("Outpainted Depth Map after Translation Adjustment")
-plt.imshow(translated_outpainted_depth_map, cmap="gray")
-plt.show()
+if DEBUG_PLOT:
+    # Display the translated outpainted depth map
+    plt.figure(figsize=(6, 6))
+    plt.title("Outpainted Depth Map after Translation Adjustment")
+    plt.imshow(translated_outpainted_depth_map, cmap="gray")
+    plt.show()
 
 # %% [markdown]
 # ## Step 3: Bilateral Filtering
-# Apply bilateral filtering to the translated outpainted depth map to smooth the transitions between the original and outpainted regions.
+# Smooth the transitions between the original and outpainted regions using the outpainted RGB frame as an edge guide: with the fast bilateral solver when OpenCV provides it (opencv-contrib built with Eigen), otherwise with a Numba joint bilateral kernel. Without an RGB guide, a plain bilateral filter is used (on the GPU when available).
 
 # %%
-filtered_outpainted_depth_map = cv2.bilateralFilter(translated_outpainted_depth_map, d=9, sigmaColor=75, sigmaSpace=75)
-
-# Display the filtered outpainted depth map
-plt.figure(figsize=(6, 6))
-plt.title("Outpainted Depth Map after Bilateral Filtering")
-plt.imshow(filtered_outpainted_depth_map, cmap="gray")
-plt.show()
+@njit(parallel=True, fastmath=True, cache=True)
+def _joint_bilateral(depth, guide, spatial_w, range_lut, r):
+    """Joint bilateral filter over uint8 depth/guide maps padded by r pixels on every side."""
+    H = depth.shape[0] - 2 * r
+    W = depth.shape[1] - 2 * r
+    out = np.empty((H, W), np.float32)
+    for y in prange(H):
+        for x in range(W):
+            gc = np.int32(guide[y + r, x + r])
+            s = 0.0
+            wsum = 0.0
+            for dy in range(2 * r + 1):
+                for dx in range(2 * r + 1):
+                    w = spatial_w[dy, dx] * range_lut[abs(np.int32(guide[y + dy, x + dx]) - gc)]
+                    s += w * depth[y + dy, x + dx]
+                    wsum += w
+            out[y, x] = s / wsum
+    return out
+
+def joint_bilateral_filter(depth, guide, d=9, sigma_color=75, sigma_space=75):
+    """Smooth a uint8 depth map with bilateral weights taken from the luma of an RGB guide frame."""
+    r = d // 2
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    spatial_w = np.exp(-(dx**2 + dy**2) / (2 * sigma_space**2)).astype(np.float32)
+    spatial_w[dx**2 + dy**2 > r * r] = 0  # circular window, as in cv2.bilateralFilter
+    range_lut = np.exp(-np.arange(256, dtype=np.float32)**2 / (2 * sigma_color**2)).astype(np.float32)
+
+    depth_padded = cv2.copyMakeBorder(depth, r, r, r, r, cv2.BORDER_REFLECT_101)
+    guide_padded = cv2.copyMakeBorder(guide, r, r, r, r, cv2.BORDER_REFLECT_101)
+    filtered = _joint_bilateral(depth_padded, guide_padded, spatial_w, range_lut, r)
+    return (filtered + 0.5).astype(np.uint8)
+
+outpainted_rgb = cv2.imread(outpainted_rgb_path)
+
+has_rgb_guide = outpainted_rgb is not None and outpainted_rgb.shape[:2] == translated_outpainted_depth_map.shape
+
+filtered_outpainted_depth_map = None
+if has_rgb_guide and xip is not None:
+    try:
+        confidence = np.full(translated_outpainted_depth_map.shape, 255, dtype=np.uint8)
+        filtered_outpainted_depth_map = xip.fastBilateralSolverFilter(outpainted_rgb, translated_outpainted_depth_map, confidence, sigma_spatial=8, sigma_luma=8, sigma_chroma=8, num_iter=25)
+    except cv2.error:
+        # The pip OpenCV wheels are built without Eigen, which the fast bilateral solver requires
+        pass
+
+if filtered_outpainted_depth_map is None and has_rgb_guide:
+    outpainted_luma = cv2.cvtColor(outpainted_rgb, cv2.COLOR_BGR2GRAY)
+    filtered_outpainted_depth_map = joint_bilateral_filter(translated_outpainted_depth_map, outpainted_luma)
+elif filtered_outpainted_depth_map is None and cv2.cuda.getCudaEnabledDeviceCount() > 0:
+    gpu_depth = cv2.cuda_GpuMat()
+    gpu_depth.upload(translated_outpainted_depth_map)
+    filtered_outpainted_depth_map = cv2.cuda.bilateralFilter(gpu_depth, 9, 75, 75).download()
+elif filtered_outpainted_depth_map is None:
+    filtered_outpainted_depth_map = cv2.bilateralFilter(translated_outpainted_depth_map, d=9, sigmaColor=75, sigmaSpace=75)
+
+if DEBUG_PLOT:
+    # Display the filtered outpainted depth map
+    plt.figure(figsize=(6, 6))
+    plt.title("Outpainted Depth Map after Bilateral Filtering")
+    plt.imshow(filtered_outpainted_depth_map, cmap="gray")
+    plt.show()
 
 # %% [markdown]
 # ## Step 4: Combine the Original and Filtered Depth Maps
@@ -109,19 +172,19 @@ center_y = (height_outpainted - height_original) // 2
 center_x = (width_outpainted - width_original) // 2
 filtered_outpainted_depth_map[center_y:center_y+height_original, center_x:center_x+width_original] = original_depth_map_np
 
-# Display the final combined depth map
-plt.figure(figsize=(6, 6))
-plt.title("Final Combined Depth Map")
-plt.imshow(filtered_outpainted_depth_map, cmap="gray")
-plt.show()
+if DEBUG_PLOT:
+    # Display the final combined depth map
+    plt.figure(figsize=(6, 6))
+    plt.title("Final Combined Depth Map")
+    plt.imshow(filtered_outpainted_depth_map, cmap="gray")
+    plt.show()
 
 # %% [markdown]
 # ## Save the Final Depth Map
-# Convert the final combined depth map to an image and save it.
+# Save the final combined depth map as an 8-bit image.
 
 # %%
-final_depth_map_image = Image.fromarray(filtered_outpainted_depth_map.astype(np.uint8))
 final_depth_map_image_path = "/mnt/data/final_depth_map.png"
-final_depth_map_image.save(final_depth_map_image_path)
+cv2.imwrite(final_depth_map_image_path, filtered_outpainted_depth_map.astype(np.uint8, copy=False))
 
 # %% [markdown]
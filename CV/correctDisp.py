@@ -3,32 +3,48 @@
 # We will start by loading the left and right images and visualize them in an anaglyph style (cyan-red overlay). This will help us see the vertical disparity between the two images.
 
 # %% 
+import os
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import minimize
+
+# Intermediate plots are only drawn when CV_SHOW=1, so batch/headless runs skip matplotlib entirely
+DEBUG_PLOT = os.environ.get("CV_SHOW", "0") == "1"
 
 # Load the stereo image pair in color
 left_image_color = cv2.imread('output/albedo_0.jpg')
 right_image_color = cv2.imread('output/albedo_1.jpg')
 height, width = left_image_color.shape[:2]
 
-# Convert color images to grayscale for phase correlation
+# Upload the right image once when a CUDA device is available, so every warp of it runs on the GPU
+use_cuda = cv2.cuda.getCudaEnabledDeviceCount() > 0
+if use_cuda:
+    gpu_right_image_color = cv2.cuda_GpuMat()
+    gpu_right_image_color.upload(right_image_color)
+
+def warp_right_image(matrix):
+    """Apply an affine warp to the right color image, on the GPU when available."""
+    dsize = (right_image_color.shape[1], right_image_color.shape[0])
+    if use_cuda:
+        return cv2.cuda.warpAffine(gpu_right_image_color, matrix, dsize, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE).download()
+    return cv2.warpAffine(right_image_color, matrix, dsize, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+# Convert color images to grayscale once, for phase correlation and ORB
 left_image_gray = cv2.cvtColor(left_image_color, cv2.COLOR_BGR2GRAY)
 right_image_gray = cv2.cvtColor(right_image_color, cv2.COLOR_BGR2GRAY)
+left_gray_f32 = left_image_gray.astype(np.float32)
+right_gray_f32 = right_image_gray.astype(np.float32)
 
-# Create anaglyph style overlay: left image Cyan, right image Red
-anaglyph_image = np.zeros_like(left_image_color)
-anaglyph_image[..., 2] = right_image_color[..., 2]  # Red channel
-anaglyph_image[..., 1] = left_image_color[..., 1]   # Green channel
-anaglyph_image[..., 0] = left_image_color[..., 0]   # Blue channel
+if DEBUG_PLOT:
+    # Create anaglyph style overlay: left image Cyan, right image Red
+    anaglyph_image = cv2.merge((left_image_color[..., 0], left_image_color[..., 1], right_image_color[..., 2]))  # Blue/Green from left, Red from right
 
-# Plot the anaglyph image
-plt.figure(figsize=(10, 10))
-plt.imshow(cv2.cvtColor(anaglyph_image, cv2.COLOR_BGR2RGB))
-plt.title("Anaglyph Image (Cyan-Red)")
-plt.axis('off')
-plt.show()
+    # Plot the anaglyph image
+    plt.figure(figsize=(10, 10))
+    plt.imshow(cv2.cvtColor(anaglyph_image, cv2.COLOR_BGR2RGB))
+    plt.title("Anaglyph Image (Cyan-Red)")
+    plt.axis('off')
+    plt.show()
 
 # %% [markdown]
 # ## Step 2: Detecting and Correcting Vertical Disparity using Affine Transformation
@@ -36,7 +52,7 @@ plt.show()
 
 # %% 
 # Use phase correlation on grayscale images to compute vertical disparity
-shift, _ = cv2.phaseCorrelate(np.float32(left_image_gray), np.float32(right_image_gray))
+shift, _ = cv2.phaseCorrelate(left_gray_f32, right_gray_f32)
 
 # Extract the vertical component of the shift (only care about vertical shift)
 vertical_shift = shift[1]
@@ -46,27 +62,25 @@ print("Vertical Shift:", -vertical_shift)
 translation_matrix_right = np.float32([[1, 0, 0], [0, 1, -vertical_shift]])
 
 # Apply vertical translation to both color images
-shifted_right_image_color_affine = cv2.warpAffine(right_image_color, translation_matrix_right, (right_image_color.shape[1], right_image_color.shape[0]), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+shifted_right_image_color_affine = warp_right_image(translation_matrix_right)
 
-# Create a new anaglyph image after affine correction
-corrected_anaglyph_image_affine = np.zeros_like(left_image_color)
-corrected_anaglyph_image_affine[..., 2] = shifted_right_image_color_affine[..., 2]  # Red channel
-corrected_anaglyph_image_affine[..., 1] = left_image_color[..., 1]   # Green channel
-corrected_anaglyph_image_affine[..., 0] = left_image_color[..., 0]   # Blue channel
+if DEBUG_PLOT:
+    # Create a new anaglyph image after affine correction
+    corrected_anaglyph_image_affine = cv2.merge((left_image_color[..., 0], left_image_color[..., 1], shifted_right_image_color_affine[..., 2]))  # Blue/Green from left, Red from right
 
-# Plot the corrected anaglyph image (Affine Correction)
-plt.figure(figsize=(10, 10))
-plt.imshow(cv2.cvtColor(corrected_anaglyph_image_affine, cv2.COLOR_BGR2RGB))
-plt.title("Corrected Anaglyph Image (Affine Correction)")
-plt.axis('off')
-plt.show()
+    # Plot the corrected anaglyph image (Affine Correction)
+    plt.figure(figsize=(10, 10))
+    plt.imshow(cv2.cvtColor(corrected_anaglyph_image_affine, cv2.COLOR_BGR2RGB))
+    plt.title("Corrected Anaglyph Image (Affine Correction)")
+    plt.axis('off')
+    plt.show()
 
 # %%
 cv2.imwrite('output/albedo_1_corY.jpg', shifted_right_image_color_affine)
 
 # %% [markdown]
 # ## Step 1: Detect Keypoints and Eliminate Vertical Outliers
-# We'll start by detecting keypoints and descriptors in both the left and right images using ORB. We'll then match these keypoints and filter out any pairs that have vertical disparities greater than 3% of the image height.
+# We'll start by detecting keypoints and descriptors in both the left and right images using ORB. We'll then match these keypoints with a ratio test and filter out any pairs that have vertical disparities greater than 3% of the image height.
 
 # %%
 # Image height for filtering threshold
@@ -76,65 +90,50 @@ image_height = left_image_color.shape[0]
 orb = cv2.ORB_create()
 
 # Detect keypoints and descriptors
-keypoints_left, descriptors_left = orb.detectAndCompute(left_image_color, None)
-keypoints_right, descriptors_right = orb.detectAndCompute(right_image_color, None)
+keypoints_left, descriptors_left = orb.detectAndCompute(left_image_gray, None)
+keypoints_right, descriptors_right = orb.detectAndCompute(right_image_gray, None)
 
-# Use BFMatcher to find the best matches between the two sets of descriptors
-bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-matches = bf.match(descriptors_left, descriptors_right)
+# Use BFMatcher to find the two nearest neighbours of each descriptor and keep
+# only unambiguous matches (Lowe's ratio test)
+bf = cv2.BFMatcher(cv2.NORM_HAMMING)
+knn_matches = bf.knnMatch(descriptors_left, descriptors_right, k=2)
+matches = [pair[0] for pair in knn_matches if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance]
 
 # Filter matches by vertical disparity (y-axis difference)
-filtered_matches = []
 threshold = 0.03 * image_height  # 3% of image height
-
-for match in matches:
-    left_point = keypoints_left[match.queryIdx].pt
-    right_point = keypoints_right[match.trainIdx].pt
-    vertical_disparity = abs(left_point[1] - right_point[1])
-    
-    if vertical_disparity <= threshold:
-        filtered_matches.append(match)
+keypoints_left_xy = np.array([kp.pt for kp in keypoints_left], dtype=np.float32).reshape(-1, 2)
+keypoints_right_xy = np.array([kp.pt for kp in keypoints_right], dtype=np.float32).reshape(-1, 2)
+query_idx = np.fromiter((m.queryIdx for m in matches), dtype=np.int32, count=len(matches))
+train_idx = np.fromiter((m.trainIdx for m in matches), dtype=np.int32, count=len(matches))
+matched_left_points = keypoints_left_xy[query_idx]
+matched_right_points = keypoints_right_xy[train_idx]
+keep = np.abs(matched_left_points[:, 1] - matched_right_points[:, 1]) <= threshold
+
+left_points = matched_left_points[keep]
+right_points = matched_right_points[keep]
+filtered_matches = [matches[i] for i in np.flatnonzero(keep)]
 
 print("Number of matches before filtering:", len(matches), "ater filtering:", len(filtered_matches))
 
-# Draw and display matches for visualization purposes
-matching_result = cv2.drawMatches(left_image_color, keypoints_left, right_image_color, keypoints_right, filtered_matches, None, flags=2)
+if DEBUG_PLOT:
+    # Draw and display matches for visualization purposes
+    matching_result = cv2.drawMatches(left_image_color, keypoints_left, right_image_color, keypoints_right, filtered_matches, None, flags=2)
 
-plt.figure(figsize=(12, 6))
-plt.imshow(cv2.cvtColor(matching_result, cv2.COLOR_BGR2RGB))
-plt.title("Keypoint Matches After Filtering by Vertical Disparity")
-plt.axis('off')
-plt.show()
+    plt.figure(figsize=(12, 6))
+    plt.imshow(cv2.cvtColor(matching_result, cv2.COLOR_BGR2RGB))
+    plt.title("Keypoint Matches After Filtering by Vertical Disparity")
+    plt.axis('off')
+    plt.show()
 
 # %% [markdown]
 # ## Step 2: Optimize y-Translation and Scaling
-# We'll now optimize the vertical translation and uniform scaling that minimizes the RMS difference in vertical disparity between the keypoints in the left image and those in the adjusted right image.
+# We'll now solve, in closed form by linear least squares, for the vertical translation and uniform scaling that minimize the RMS difference in vertical disparity between the keypoints in the left image and those in the adjusted right image.
 
 # %%
-# Collect points from filtered matches
-left_points = np.float32([keypoints_left[m.queryIdx].pt for m in filtered_matches])
-right_points = np.float32([keypoints_right[m.trainIdx].pt for m in filtered_matches])
-
-def compute_rms_disparity(y_translation, scaling, left_points, right_points):
-    # Apply scaling and vertical translation to the right points
-    adjusted_right_points = right_points.copy()
-    adjusted_right_points[:, 0] *= scaling  # Apply uniform scaling to x
-    adjusted_right_points[:, 1] = adjusted_right_points[:, 1] * scaling + y_translation  # Apply scaling and vertical shift to y
-    
-    # Compute RMS of the vertical disparity
-    vertical_disparity = left_points[:, 1] - adjusted_right_points[:, 1]
-    rms = np.sqrt(np.mean(vertical_disparity**2))
-    return rms
-
-# Search for the best combination of y translation and scaling that minimizes the RMS
-# Initial guess: no scaling, no vertical translation
-initial_guess = [0, 1.0]
-
-# Minimize the RMS disparity
-result = minimize(lambda params: compute_rms_disparity(params[0], params[1], left_points, right_points), initial_guess, method='Powell')
-
-# Extract the optimal y translation and scaling values
-optimal_y_translation, optimal_scaling = result.x
+# The vertical disparity is linear in (scaling, y translation), so solve
+# left_y ~= scaling * right_y + y_translation as a least-squares problem
+A = np.column_stack([right_points[:, 1], np.ones(len(right_points))])
+(optimal_scaling, optimal_y_translation), *_ = np.linalg.lstsq(A, left_points[:, 1], rcond=None)
 print(f"Optimal y-Translation: {optimal_y_translation:.2f}, Optimal Scaling: {optimal_scaling:.4f}")
 
 # %% [markdown]
@@ -146,29 +145,63 @@ print(f"Optimal y-Translation: {optimal_y_translation:.2f}, Optimal Scaling: {op
 affine_matrix = np.float32([[optimal_scaling, 0, 0], [0, optimal_scaling, optimal_y_translation]])
 
 # Apply the affine transformation to the right image
-adjusted_right_image_color = cv2.warpAffine(right_image_color, affine_matrix, (right_image_color.shape[1], right_image_color.shape[0]), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+adjusted_right_image_color = warp_right_image(affine_matrix)
 
 # %% [markdown]
 # ## Step 4: Visualize the Corrected Anaglyph
 # Now we’ll plot the anaglyph superposition to visualize the result after applying the translation and scaling correction.
 
 # %%
-# Create a new anaglyph image after correction
-corrected_anaglyph_image = np.zeros_like(left_image_color)
-corrected_anaglyph_image[..., 2] = adjusted_right_image_color[..., 2]  # Red channel
-corrected_anaglyph_image[..., 1] = left_image_color[..., 1]   # Green channel
-corrected_anaglyph_image[..., 0] = left_image_color[..., 0]   # Blue channel
-
-# Plot the corrected anaglyph image
-plt.figure(figsize=(10, 10))
-plt.imshow(cv2.cvtColor(corrected_anaglyph_image, cv2.COLOR_BGR2RGB))
-plt.title("Corrected Anaglyph Image (Cyan-Red)")
-plt.axis('off')
-plt.show()
+if DEBUG_PLOT:
+    # Create a new anaglyph image after correction
+    corrected_anaglyph_image = cv2.merge((left_image_color[..., 0], left_image_color[..., 1], adjusted_right_image_color[..., 2]))  # Blue/Green from left, Red from right
+
+    # Plot the corrected anaglyph image
+    plt.figure(figsize=(10, 10))
+    plt.imshow(cv2.cvtColor(corrected_anaglyph_image, cv2.COLOR_BGR2RGB))
+    plt.title("Corrected Anaglyph Image (Cyan-Red)")
+    plt.axis('off')
+    plt.show()
 
 # %% [markdown]
 # ## Step 5: Saving the Corrected Right Image
 # Finally, we will save the corrected right image into the "output" folder.
 
 # %%
-cv2.imwrite('output/albedo_1_cor.jpg', adjusted_right_image_color)
\ No newline at end of file
+cv2.imwrite('output/albedo_1_cor.jpg', adjusted_right_image_color)
+
+# %% [markdown]
+# ## Optional: Batch Keypoint Matching on the GPU
+# When sweeping a folder of stereo pairs, ORB detection and matching can run on the GPU with one CUDA stream per pair, so that uploads, kernels and downloads of different pairs overlap. `match_stereo_pairs_cuda` is not called on the single pair processed above.
+
+# %%
+def match_stereo_pairs_cuda(pairs, num_streams=4):
+    """Detect and match ORB keypoints for a list of (left_gray, right_gray) pairs on the GPU.
+
+    Pairs are dispatched round-robin over `num_streams` CUDA streams. Returns a list of
+    (keypoints_left, keypoints_right, matches) tuples, one per pair.
+    """
+    streams = [cv2.cuda_Stream() for _ in range(num_streams)]
+    orbs = [cv2.cuda_ORB.create() for _ in range(num_streams)]
+    matchers = [cv2.cuda.DescriptorMatcher_createBFMatcher(cv2.NORM_HAMMING) for _ in range(num_streams)]
+    gpu_left = [cv2.cuda_GpuMat() for _ in range(num_streams)]
+    gpu_right = [cv2.cuda_GpuMat() for _ in range(num_streams)]
+
+    results = []
+    for start in range(0, len(pairs), num_streams):
+        # Enqueue upload, detect+describe and match for every pair of the batch
+        pending = []
+        for i, (left_gray, right_gray) in enumerate(pairs[start:start + num_streams]):
+            gpu_left[i].upload(left_gray, stream=streams[i])
+            gpu_right[i].upload(right_gray, stream=streams[i])
+            gpu_kp_left, gpu_desc_left = orbs[i].detectAndComputeAsync(gpu_left[i], None, stream=streams[i])
+            gpu_kp_right, gpu_desc_right = orbs[i].detectAndComputeAsync(gpu_right[i], None, stream=streams[i])
+            gpu_matches = matchers[i].matchAsync(gpu_desc_left, gpu_desc_right, stream=streams[i])
+            pending.append((gpu_kp_left, gpu_kp_right, gpu_matches))
+
+        # Wait on each stream and bring the results back to the host
+        for i, (gpu_kp_left, gpu_kp_right, gpu_matches) in enumerate(pending):
+            streams[i].waitForCompletion()
+            results.append((orbs[i].convert(gpu_kp_left), orbs[i].convert(gpu_kp_right), matchers[i].matchConvert(gpu_matches)))
+
+    return results
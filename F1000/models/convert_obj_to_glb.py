@@ -4,14 +4,134 @@ Convert OBJ file to GLB format
 """
 import sys
 import os
+import re
+import json
+import struct
 
 try:
-    import trimesh
+    import numpy as np
 except ImportError:
-    print("Error: trimesh library not found. Installing...")
+    print("Error: numpy library not found. Installing...")
     import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "trimesh[easy]"])
-    import trimesh
+    subprocess.check_call([sys.executable, "-m", "pip", "install", "numpy"])
+    import numpy as np
+
+# glTF binary container constants
+GLB_MAGIC = 0x46546C67  # "glTF"
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A  # "JSON"
+CHUNK_BIN = 0x004E4942  # "BIN\0"
+
+# glTF enums
+FLOAT = 5126
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+TRIANGLES = 4
+
+def _pad4(data, fill):
+    """Pad bytes to a multiple of 4, as required for GLB chunks"""
+    return data + fill * (-len(data) % 4)
+
+def parse_obj(obj_path):
+    """
+    Parse vertex positions and triangle indices from an OBJ file
+
+    Only 'v' and 'f' records are read; texture coordinates, normals and
+    materials are ignored. Polygons are fan-triangulated.
+
+    Returns:
+        (vertices, faces): (N, 3) float32 and (M, 3) uint32 arrays
+    """
+    with open(obj_path, 'rb') as f:
+        lines = f.read().splitlines()
+
+    # Classify records by keyword, tolerating indentation and tab separators
+    records = [r for r in (line.split(None, 1) for line in lines) if len(r) == 2]
+    keywords = [r[0] for r in records]
+    v_lines = [r[1] for r in records if r[0] == b'v']
+    f_lines = [r[1] for r in records if r[0] == b'f']
+    if not v_lines or not f_lines:
+        raise ValueError(f"OBJ file has no vertices or faces: {obj_path}")
+
+    # Number of vertices defined before each face, which negative indices are relative to
+    is_v = np.fromiter((k == b'v' for k in keywords), dtype=bool, count=len(keywords))
+    is_f = np.fromiter((k == b'f' for k in keywords), dtype=bool, count=len(keywords))
+    face_vertex_counts = np.cumsum(is_v)[is_f]
+
+    # Vertices: parse the whole block in one go, keep x, y, z (drop optional w / vertex colors)
+    values = np.array(b' '.join(v_lines).split(), dtype=np.float32)
+    if len(values) % len(v_lines):
+        raise ValueError(f"Inconsistent vertex records in OBJ file: {obj_path}")
+    vertices = np.ascontiguousarray(values.reshape(len(v_lines), -1)[:, :3])
+
+    # Faces: strip "/vt/vn" references, then parse the whole block in one go
+    tokens = re.sub(rb'/\S*', b'', b' '.join(f_lines)).split()
+    if len(tokens) == 3 * len(f_lines):
+        indices = np.array(tokens, dtype=np.int64).reshape(-1, 3)
+        vertex_counts = face_vertex_counts
+    else:
+        # Mixed polygons: fan-triangulate each face
+        triangles = []
+        counts = []
+        for line, count in zip(f_lines, face_vertex_counts):
+            face = [int(t.split(b'/')[0]) for t in line.split()]
+            triangles.extend((face[0], face[i], face[i + 1]) for i in range(1, len(face) - 1))
+            counts.extend([count] * max(len(face) - 2, 0))
+        indices = np.array(triangles, dtype=np.int64).reshape(-1, 3)
+        vertex_counts = np.array(counts, dtype=np.int64)
+
+    # OBJ indices are 1-based, negative indices count back from the last vertex defined so far
+    indices = np.where(indices < 0, indices + vertex_counts[:, None], indices - 1)
+    if len(indices) == 0 or indices.min() < 0 or indices.max() >= len(vertices):
+        raise ValueError(f"OBJ file has out-of-range face indices: {obj_path}")
+    return vertices, indices.astype(np.uint32)
+
+def write_glb(glb_path, vertices, faces):
+    """
+    Write a single triangle mesh (positions + indices) as a GLB file
+    """
+    positions = vertices.astype(np.float32, copy=False).tobytes()
+    indices = faces.astype(np.uint32, copy=False).tobytes()
+    bin_chunk = _pad4(positions + indices, b'\x00')
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "convert_obj_to_glb.py"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": 1, "mode": TRIANGLES}]}],
+        "buffers": [{"byteLength": len(bin_chunk)}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": 0, "byteLength": len(positions), "target": ARRAY_BUFFER},
+            {"buffer": 0, "byteOffset": len(positions), "byteLength": len(indices), "target": ELEMENT_ARRAY_BUFFER},
+        ],
+        "accessors": [
+            {
+                "bufferView": 0,
+                "componentType": FLOAT,
+                "count": len(vertices),
+                "type": "VEC3",
+                "min": vertices.min(axis=0).tolist(),
+                "max": vertices.max(axis=0).tolist(),
+            },
+            {
+                "bufferView": 1,
+                "componentType": UNSIGNED_INT,
+                "count": faces.size,
+                "type": "SCALAR",
+            },
+        ],
+    }
+    json_chunk = _pad4(json.dumps(gltf, separators=(',', ':')).encode('utf-8'), b' ')
+
+    total_length = 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)
+    with open(glb_path, 'wb') as f:
+        f.write(struct.pack('<III', GLB_MAGIC, GLB_VERSION, total_length))
+        f.write(struct.pack('<II', len(json_chunk), CHUNK_JSON))
+        f.write(json_chunk)
+        f.write(struct.pack('<II', len(bin_chunk), CHUNK_BIN))
+        f.write(bin_chunk)
 
 def convert_obj_to_glb(obj_path, glb_path=None):
     """
@@ -31,15 +151,15 @@ def convert_obj_to_glb(obj_path, glb_path=None):
     print(f"Loading OBJ file: {obj_path}")
 
     # Load the OBJ file
-    mesh = trimesh.load(obj_path, force='mesh')
+    vertices, faces = parse_obj(obj_path)
 
     print(f"Mesh info:")
-    print(f"  - Vertices: {len(mesh.vertices)}")
-    print(f"  - Faces: {len(mesh.faces)}")
+    print(f"  - Vertices: {len(vertices)}")
+    print(f"  - Faces: {len(faces)}")
 
     # Export to GLB
     print(f"Exporting to GLB: {glb_path}")
-    mesh.export(glb_path, file_type='glb')
+    write_glb(glb_path, vertices, faces)
 
     print(f"✓ Conversion complete!")
     print(f"  Output: {glb_path}")